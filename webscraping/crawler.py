@@ -1,31 +1,33 @@
+import atexit
 import time
 import logging
 from logging.handlers import RotatingFileHandler
 import sqlite3
 import threading
 import multiprocessing
-import traceback
-from collections import deque
-from urllib.parse import urljoin, urlparse
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import os
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from queue import Queue, Empty
 from contextlib import contextmanager
 
+import httpx
 import undetected_chromedriver as uc
-from bs4 import BeautifulSoup
+from pybloom_live import ScalableBloomFilter
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException
+from selenium.common.exceptions import TimeoutException, WebDriverException
 from tqdm import tqdm
 
+from db import open_db
+from page_parser import parse_page
+
 # --- Configuration ---
 # --- IMPORTANT: Visual mode is required for this site to work reliably. ---
 RUN_IN_VISUAL_MODE = True
 
 START_URL = "https://dev.epicgames.com/documentation/en-us/unreal-engine"
 URL_PREFIX = "https://dev.epicgames.com/documentation/en-us/unreal-engine"
-ALLOWED_DOMAIN = "dev.epicgames.com"
 DB_FILE = "crawled_data.db"
 LOG_FILE = "crawler.log"
 
@@ -33,32 +35,87 @@ MAX_WORKERS = 4 if RUN_IN_VISUAL_MODE else min(10, multiprocessing.cpu_count() +
 DRIVER_RECYCLE_INTERVAL_SECONDS = 3600
 MAX_RETRIES = 3 
 WEBDRIVER_TIMEOUT_SECONDS = 120
+PARSE_WORKERS = os.cpu_count() or 1
+PARSE_TIMEOUT_SECONDS = 30
+CONTENT_SELECTOR = "main"
+# Only HTML is needed; images, fonts, media and trackers are blocked at the network layer
+BLOCKED_URL_PATTERNS = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.svg",
+    "*.woff", "*.woff2", "*.ttf", "*.mp4",
+    "*googletagmanager*", "*analytics*",
+]
+# Bloom filter positives are confirmed against the pages table, so a false positive costs one indexed read
+SEEN_URLS_ERROR_RATE = 1e-4
+WRITE_BATCH_SIZE = 200
+WRITE_BATCH_WINDOW_SECONDS = 0.25
+WAL_AUTOCHECKPOINT_PAGES = 2000
+WAL_CHECKPOINT_EVERY_WRITES = 10_000
+QUEUE_PAGE_SIZE = 1000 # URLs read per short read transaction when filling the URL queue
+
+# Try a plain HTTP request before falling back to Chrome; most pages are served without JS.
+USE_HTTP_FAST_PATH = True
+HTTP_TIMEOUT_SECONDS = 15
+HTTP_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137.0.0.0 Safari/537.36"
+
+# Runs inside the page: a.href is already absolute, so this mirrors page_parser.extract_links() without a DOM round trip.
+EXTRACT_LINKS_JS = """
+const prefix = arguments[0];
+const links = Array.from(document.querySelectorAll('a[href]'), a => a.href.split('#')[0].split('?')[0]);
+return [document.title, links.filter(h => h.startsWith(prefix))];
+"""
 
 # --- Logging Setup ---
-log_formatter = logging.Formatter('%(asctime)s - %(threadName)s - %(levelname)s - %(message)s')
-log_handler = RotatingFileHandler(LOG_FILE, maxBytes=10*1024*1024, backupCount=3)
-log_handler.setFormatter(log_formatter)
-# --- MODIFIED: Console handler is removed to disable terminal logging ---
-logger = logging.getLogger()
-logger.setLevel(logging.INFO) 
-logger.addHandler(log_handler)
+# Called from main(), not at import time: the spawn-based parse pool re-imports this module in every
+# child, and a handler opened there would hold crawler.log open and break rotation on Windows.
+def setup_logging():
+    log_formatter = logging.Formatter('%(asctime)s - %(threadName)s - %(levelname)s - %(message)s')
+    log_handler = RotatingFileHandler(LOG_FILE, maxBytes=10*1024*1024, backupCount=3)
+    log_handler.setFormatter(log_formatter)
+    # --- MODIFIED: Console handler is removed to disable terminal logging ---
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO) 
+    logger.addHandler(log_handler)
+
+def create_http_client() -> httpx.Client:
+    """Returns the client shared by all workers, so TCP/TLS connections and HTTP/2 streams are reused across URLs."""
+    return httpx.Client(http2=True, timeout=HTTP_TIMEOUT_SECONDS, headers={"User-Agent": HTTP_USER_AGENT}, follow_redirects=True)
 
 
 # --- Database & State Management ---
+# Each thread lazily opens its own read connection; all writes go through the DBWriter thread.
+_tls = threading.local()
+
+def get_conn() -> sqlite3.Connection:
+    """Returns the calling thread's connection, opening it on first use."""
+    conn = getattr(_tls, "conn", None)
+    if conn is None:
+        conn = _tls.conn = open_db(DB_FILE, timeout=30, isolation_level=None)
+    return conn
+
+def close_conn():
+    """Closes the calling thread's connection, if it opened one."""
+    conn = getattr(_tls, "conn", None)
+    if conn is not None:
+        conn.close()
+        _tls.conn = None
+
 def init_db(db_path: str):
     """Ensures the required tables and columns exist."""
-    with sqlite3.connect(db_path) as conn:
+    with open_db(db_path) as conn:
         cursor = conn.cursor()
+        # WITHOUT ROWID clusters rows on the url key, so the URL is stored once instead of in table + index
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS pages (
                 url TEXT PRIMARY KEY, title TEXT, scraped_at REAL,
                 attempts INTEGER DEFAULT 0, status TEXT DEFAULT 'new'
-            )
+            ) WITHOUT ROWID
         """)
         try: cursor.execute("ALTER TABLE pages ADD COLUMN status TEXT DEFAULT 'new'")
         except sqlite3.OperationalError: pass
         try: cursor.execute("ALTER TABLE pages ADD COLUMN attempts INTEGER DEFAULT 0")
         except sqlite3.OperationalError: pass
+        # Lets the startup "pending URLs" query search an index instead of scanning every page
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_pages_status_attempts ON pages(status, attempts)")
         conn.commit()
 
 # --- WebDriver Pool & Worker ---
@@ -66,6 +123,10 @@ def create_driver():
     options = uc.ChromeOptions()
     options.headless = not RUN_IN_VISUAL_MODE
     options.add_argument("--disable-blink-features=AutomationControlled")
+    # Return from driver.get() at DOMContentLoaded; the worker waits for the content it needs itself
+    options.page_load_strategy = "eager"
+    options.add_argument("--blink-settings=imagesEnabled=false")
+    options.add_experimental_option("prefs", {"profile.managed_default_content_settings.images": 2})
     if RUN_IN_VISUAL_MODE:
         options.add_argument("window-size=1280,720")
     else:
@@ -76,177 +137,346 @@ def create_driver():
         chrome_major_version = 137
         driver = uc.Chrome(version_main=chrome_major_version, options=options)
     except Exception as e:
-        logging.error(f"Failed to create undetected_chromedriver: {e}")
+        logging.error("Failed to create undetected_chromedriver: %s", e)
         return None
+    block_heavy_resources(driver)
     return driver
 
+def block_heavy_resources(driver):
+    """Applies BLOCKED_URL_PATTERNS to the driver's current tab."""
+    try:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_URL_PATTERNS})
+    except Exception as e:
+        logging.warning("Could not enable request blocking, pages will load in full: %s", e)
+
+def refresh_driver(driver) -> bool:
+    """Moves the driver onto a fresh tab and closes the old ones, releasing their renderer memory.
+
+    This takes milliseconds, whereas quitting and relaunching Chrome takes seconds.
+    """
+    try:
+        old_handles = driver.window_handles
+        driver.switch_to.new_window("tab")
+        fresh_handle = driver.current_window_handle
+        for handle in old_handles:
+            driver.switch_to.window(handle)
+            driver.close()
+        driver.switch_to.window(fresh_handle)
+        driver.execute_cdp_cmd("Network.clearBrowserCache", {})
+    except WebDriverException as e:
+        logging.warning("Could not refresh driver tab, relaunching Chrome instead: %s", e)
+        return False
+    # Request blocking is per tab, so it has to be applied again
+    block_heavy_resources(driver)
+    return True
+
 @contextmanager
 def get_driver_from_pool(driver_pool: Queue):
     driver, creation_time = driver_pool.get()
     try:
         if time.time() - creation_time > DRIVER_RECYCLE_INTERVAL_SECONDS:
-            if driver: driver.quit()
-            driver = create_driver()
+            if not (driver and refresh_driver(driver)):
+                if driver: driver.quit()
+                driver = create_driver()
             creation_time = time.time()
         yield driver
     finally:
         driver_pool.put((driver, creation_time))
 
-def worker(url: str, driver_pool: Queue) -> dict:
+def fetch_without_browser(url: str, http_client: httpx.Client, parse_pool: ProcessPoolExecutor):
+    """Fetches the page over plain HTTP. Returns None if it needs a real browser."""
+    try:
+        response = http_client.get(url)
+    except httpx.HTTPError as e:
+        logging.info("HTTP fast path failed for %s: %s", url, e)
+        return None
+    # Cloudflare challenges and JS-only shells have neither the docs title nor a <main> element
+    if response.status_code != 200 or "<main" not in response.text:
+        return None
+    title, new_links = parse_pool.submit(parse_page, response.text, str(response.url), URL_PREFIX).result(timeout=PARSE_TIMEOUT_SECONDS)
+    if "Unreal Engine" not in title:
+        return None
+    return {"status": "success", "title": title, "new_links": new_links}
+
+def worker(url: str, driver_pool: Queue, http_client: httpx.Client, parse_pool: ProcessPoolExecutor) -> dict:
     """Processes a single URL and returns its result."""
-    logging.info(f"Worker starting for url: {url}")
+    logging.info("Worker starting for url: %s", url)
     try:
+        if USE_HTTP_FAST_PATH:
+            result = fetch_without_browser(url, http_client, parse_pool)
+            if result:
+                logging.info("Worker success for %s without browser. Found %d new links.", url, len(result['new_links']))
+                return result
+
         with get_driver_from_pool(driver_pool) as driver:
             if driver is None: return {"status": "failed_driver", "new_links": set()}
             
             driver.get(url)
 
-            start_time = time.time()
-            title_found = False
-            while time.time() - start_time < WEBDRIVER_TIMEOUT_SECONDS:
-                if "Unreal Engine" in driver.title:
-                    title_found = True
-                    break
-                time.sleep(1) 
-            
-            if not title_found:
-                logging.warning(f"Timeout waiting for title on {url}. Attempting to scrape partial content.")
+            # Returns as soon as the docs title and the <main> content node are present
+            try:
+                WebDriverWait(driver, WEBDRIVER_TIMEOUT_SECONDS).until(EC.all_of(
+                    EC.title_contains("Unreal Engine"),
+                    EC.presence_of_element_located((By.CSS_SELECTOR, CONTENT_SELECTOR)),
+                ))
+            except TimeoutException:
+                logging.warning("Timeout waiting for content on %s. Attempting to scrape partial content.", url)
 
-            time.sleep(2)
-            soup = BeautifulSoup(driver.page_source, "html.parser")
-            title = soup.title.string.strip() if soup.title else "Untitled"
-            
-            new_links = {
-                urljoin(url, a["href"]).split("?")[0]
-                for a in soup.find_all("a", href=True)
-                if urljoin(url, a["href"]).startswith(URL_PREFIX)
-            }
-            logging.info(f"Worker success for {url}. Found {len(new_links)} new links.")
+            try:
+                # Only the title and matching hrefs cross the DevTools pipe, not the whole serialized DOM
+                title, hrefs = driver.execute_script(EXTRACT_LINKS_JS, URL_PREFIX)
+                title = title.strip() or "Untitled"
+                new_links = set(hrefs)
+            except WebDriverException:
+                logging.warning("In-page link extraction failed on %s. Falling back to page_source.", url)
+                title, new_links = parse_pool.submit(parse_page, driver.page_source, url, URL_PREFIX).result(timeout=PARSE_TIMEOUT_SECONDS)
+                title = title or "Untitled"
+            logging.info("Worker success for %s. Found %d new links.", url, len(new_links))
             return {"status": "success", "title": title, "new_links": new_links}
             
     except Exception:
-        logging.error(f"Worker failed on url {url}:\n{traceback.format_exc()}")
+        logging.exception("Worker failed on url %s", url)
         return {"status": "failed", "new_links": set()}
 
+def worker_loop(url_queue: Queue, result_queue: Queue, driver_pool: Queue, http_client: httpx.Client, parse_pool: ProcessPoolExecutor):
+    """Crawls URLs from the queue until it receives the None sentinel."""
+    while True:
+        url = url_queue.get()
+        if url is None:
+            url_queue.task_done()
+            break
+        # task_done() for this URL is called by results_loop once its writes have been queued
+        result_queue.put((url, worker(url, driver_pool, http_client, parse_pool)))
+
+def queue_urls(url_queue: Queue, where: str, params: tuple = ()) -> int:
+    """Feeds the URLs of pages matching `where` into the bounded URL queue and returns how many were queued."""
+    # A read-only connection never contends with the writer, and rows are never materialized all at once
+    conn = open_db(f"file:{DB_FILE}?mode=ro", uri=True, timeout=30, isolation_level=None)
+    query = f"SELECT url FROM pages WHERE {where} AND url > ? ORDER BY url LIMIT ?"
+    queued = 0
+    last_url = ""
+    try:
+        while True:
+            # Keyset paging: each page is read to the end before the blocking puts below, so its read
+            # transaction is already over and the writer's WAL checkpoints never wait on this connection
+            rows = conn.execute(query, (*params, last_url, QUEUE_PAGE_SIZE)).fetchall()
+            if not rows: break
+            for (url,) in rows:
+                url_queue.put(url)
+            queued += len(rows)
+            last_url = rows[-1][0]
+    finally:
+        conn.close()
+    return queued
+
+def is_known_url(url: str) -> bool:
+    """Returns whether the URL is already committed to the pages table."""
+    return get_conn().execute("SELECT 1 FROM pages WHERE url = ?", (url,)).fetchone() is not None
+
+def results_loop(url_queue: Queue, result_queue: Queue, db_write_queue: Queue, seen_urls: ScalableBloomFilter):
+    """Fans worker results into DB writes."""
+    while True:
+        item = result_queue.get()
+        if item is None: break
+
+        original_url, result = item
+        if result["status"] == "success":
+            db_write_queue.put(("add_content", (original_url, result['title'])))
+            # add() returns True when the link was (probably) seen already in this run. A negative is certain;
+            # a positive is confirmed in SQLite, because a skipped link on a 'success' page is never found again
+            unseen_links = [link for link in result["new_links"] if not seen_urls.add(link) or not is_known_url(link)]
+            if unseen_links:
+                # INSERT OR IGNORE in the DB Writer decides which links are really new
+                db_write_queue.put(("add_new_links", unseen_links))
+        else:
+            db_write_queue.put(("update_status", (original_url, result['status'])))
+        url_queue.task_done()
+    close_conn()
+
 # --- Dedicated Database Writer Thread ---
-def db_writer(db_path: str, write_queue: Queue, stop_event: threading.Event, pbar: tqdm):
-    """A dedicated thread to handle all database writes, preventing lock contention."""
-    conn = sqlite3.connect(db_path, timeout=10)
+def apply_write_job(cursor: sqlite3.Cursor, item: tuple) -> tuple:
+    """Executes a single queued write inside the writer's open transaction. Returns (pages done, pages added)."""
+    job_type, data = item
+    if job_type == "update_status":
+        url, status = data
+        cursor.execute("UPDATE pages SET status = ?, attempts = attempts + 1 WHERE url = ?", (status, url))
+    elif job_type == "add_content":
+        url, title = data
+        cursor.execute("UPDATE pages SET title = ?, scraped_at = ?, status = 'success', attempts = attempts + 1 WHERE url = ?", (title, time.time(), url))
+        return 1, 0
+    elif job_type == "add_new_links":
+        # rowcount only counts rows that were really inserted
+        cursor.executemany("INSERT OR IGNORE INTO pages (url) VALUES (?)", ((link,) for link in data))
+        return 0, cursor.rowcount
+    return 0, 0
+
+def commit_write_jobs(conn: sqlite3.Connection, cursor: sqlite3.Cursor, items: list, pbar: tqdm):
+    """Commits the jobs in one transaction, then moves the progress bar by what was committed."""
+    done = added = 0
+    cursor.execute("BEGIN IMMEDIATE")
+    for item in items:
+        job_done, job_added = apply_write_job(cursor, item)
+        done += job_done
+        added += job_added
+    conn.commit()
+    pbar.total += added
+    pbar.update(done)
+
+def db_writer(db_path: str, write_queue: Queue, pbar: tqdm):
+    """A dedicated thread to handle all database writes, preventing lock contention. Stops on a None job."""
+    conn = open_db(db_path, timeout=10)
+    conn.execute(f"PRAGMA wal_autocheckpoint={WAL_AUTOCHECKPOINT_PAGES}")
     cursor = conn.cursor()
+    writes_since_checkpoint = 0
     
-    while not stop_event.is_set() or not write_queue.empty():
+    stopping = False
+    while not stopping:
+        # Sleep until there is work, then group whatever arrives within a short window into a single transaction (one fsync)
+        batch = []
+        while len(batch) < WRITE_BATCH_SIZE:
+            try:
+                item = write_queue.get(timeout=0.05) if batch else write_queue.get()
+            except Empty:
+                break
+            if item is None:
+                write_queue.task_done()
+                stopping = True
+                break
+            batch.append(item)
+            if len(batch) == 1:
+                deadline = time.monotonic() + WRITE_BATCH_WINDOW_SECONDS
+            elif time.monotonic() >= deadline:
+                break
+        if not batch: continue
+
         try:
-            item = write_queue.get(timeout=1)
-            if item is None: continue
-
-            job_type, data = item
-            if job_type == "update_status":
-                url, status = data
-                cursor.execute("UPDATE pages SET status = ?, attempts = attempts + 1 WHERE url = ?", (status, url))
-            elif job_type == "add_content":
-                url, title = data
-                cursor.execute("UPDATE pages SET title = ?, scraped_at = ?, status = 'success', attempts = attempts + 1 WHERE url = ?", (title, time.time(), url))
-                pbar.update(1)
-            elif job_type == "add_new_links":
-                cursor.execute("SELECT count(*) FROM pages")
-                count_before = cursor.fetchone()[0]
-                cursor.executemany("INSERT OR IGNORE INTO pages (url) VALUES (?)", data)
-                cursor.execute("SELECT count(*) FROM pages")
-                count_after = cursor.fetchone()[0]
-                pbar.total += (count_after - count_before)
-
-            conn.commit()
-            write_queue.task_done()
-        except Empty:
-            continue
+            commit_write_jobs(conn, cursor, batch, pbar)
         except Exception as e:
-            logging.error(f"[DBWriter] Error processing job: {e}")
+            conn.rollback()
+            # One bad job must not take the rest of the batch (and the links it carries) down with it
+            logging.error("[DBWriter] A batch of %d jobs failed, retrying them one at a time: %s", len(batch), e)
+            for item in batch:
+                try:
+                    commit_write_jobs(conn, cursor, [item], pbar)
+                except Exception as e:
+                    conn.rollback()
+                    logging.error("[DBWriter] Dropped a %s job: %s", item[0], e)
+        finally:
+            for _ in batch: write_queue.task_done()
+
+        writes_since_checkpoint += len(batch)
+        if writes_since_checkpoint >= WAL_CHECKPOINT_EVERY_WRITES:
+            # Keeps the -wal file from growing without bound during long crawls
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            writes_since_checkpoint = 0
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone():
+        # Re-analyzes only the tables whose statistics have drifted, so a normal exit stays cheap
+        conn.execute("PRAGMA optimize")
+    else:
+        # The first crawl's bulk inserts leave no planner statistics; one ANALYZE lets the next startup use the index
+        conn.execute("ANALYZE")
     conn.close()
     logging.info("DBWriter thread finished.")
 
 
 # --- Main Orchestrator ---
 def main():
+    setup_logging()
+    atexit.register(close_conn)
     init_db(DB_FILE)
     
-    with sqlite3.connect(DB_FILE) as conn:
-        cursor = conn.cursor()
-        cursor.execute("INSERT OR IGNORE INTO pages (url) VALUES (?)", (START_URL.split("?")[0],))
-        cursor.execute("SELECT url FROM pages WHERE status != 'success' AND attempts < ?", (MAX_RETRIES,))
-        urls_to_process = deque([row[0] for row in cursor.fetchall()])
-        cursor.execute("SELECT count(*) FROM pages WHERE status = 'success'")
-        completed_count = cursor.fetchone()[0]
-        cursor.execute("SELECT count(*) FROM pages")
-        total_known_urls = cursor.fetchone()[0]
-        conn.commit()
+    cursor = get_conn().cursor()
+    cursor.execute("INSERT OR IGNORE INTO pages (url) VALUES (?)", (START_URL.split("?")[0],))
+    cursor.execute("SELECT count(*) FROM pages WHERE status != 'success' AND attempts < ?", (MAX_RETRIES,))
+    pending_count = cursor.fetchone()[0]
+    cursor.execute("SELECT count(*) FROM pages WHERE status = 'success'")
+    completed_count = cursor.fetchone()[0]
+    cursor.execute("SELECT count(*) FROM pages")
+    total_known_urls = cursor.fetchone()[0]
+
+    # Links repeat on almost every page (navigation, breadcrumbs); send each one to the DB once per run
+    seen_urls = ScalableBloomFilter(initial_capacity=100_000, error_rate=SEEN_URLS_ERROR_RATE)
 
-    if not urls_to_process:
+    if not pending_count:
         print("All known URLs have been processed. Nothing to do.")
         return
         
-    print(f"Starting crawl. To-Do: {len(urls_to_process)}, Completed: {completed_count}, Total Known: {total_known_urls}")
+    print(f"Starting crawl. To-Do: {pending_count}, Completed: {completed_count}, Total Known: {total_known_urls}")
 
     driver_pool = Queue(maxsize=MAX_WORKERS)
-    for _ in range(MAX_WORKERS):
-        driver = create_driver()
-        if driver: driver_pool.put((driver, time.time()))
+    # Launch all browsers at once; each cold start is several seconds of mostly waiting
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="DriverLauncher") as launcher:
+        for driver in launcher.map(lambda _: create_driver(), range(MAX_WORKERS)):
+            if driver: driver_pool.put((driver, time.time()))
 
     if driver_pool.empty():
         print("Could not create any WebDriver instances. Exiting.")
         return
 
     db_write_queue = Queue()
-    stop_event = threading.Event()
     
     pbar = tqdm(total=total_known_urls, initial=completed_count, desc="Crawling")
     
-    writer_thread = threading.Thread(target=db_writer, args=(DB_FILE, db_write_queue, stop_event, pbar), daemon=True, name="DBWriter")
+    writer_thread = threading.Thread(target=db_writer, args=(DB_FILE, db_write_queue, pbar), daemon=True, name="DBWriter")
     writer_thread.start()
 
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="Crawler") as executor:
-        futures = {executor.submit(worker, urls_to_process.popleft(), driver_pool): url for url in [urls_to_process.popleft() for _ in range(min(len(urls_to_process), MAX_WORKERS))]}
+    # HTML parsing is CPU-bound, so it runs in separate processes instead of contending for the GIL.
+    # "spawn" avoids forking a process that already runs the writer thread. The children re-import this
+    # module, which is why everything with side effects lives in main() and parsing in page_parser.py.
+    parse_pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    http_client = create_http_client()
+
+    # Bounded, so producers block instead of piling up URLs faster than the workers can crawl them
+    url_queue = Queue(maxsize=MAX_WORKERS * 4)
+    result_queue = Queue()
+
+    worker_threads = [
+        threading.Thread(target=worker_loop, args=(url_queue, result_queue, driver_pool, http_client, parse_pool), daemon=True, name=f"Crawler_{i}")
+        for i in range(MAX_WORKERS)
+    ]
+    for thread in worker_threads: thread.start()
+    results_thread = threading.Thread(target=results_loop, args=(url_queue, result_queue, db_write_queue, seen_urls), daemon=True, name="Results")
+    results_thread.start()
+
+    try:
+        # First the resumable backlog, then repeatedly the links that the previous pass inserted
+        queued = queue_urls(url_queue, "status != 'success' AND attempts < ?", (MAX_RETRIES,))
+        while queued:
+            url_queue.join()
+            # Make sure the links discovered in this pass are committed before looking for them
+            db_write_queue.join()
+            queued = queue_urls(url_queue, "status = 'new' AND attempts = 0")
+            logging.info("Queued %d newly discovered URLs.", queued)
+        logging.info("URL queue is empty. All workers are idle.")
+    except KeyboardInterrupt:
+        print("\nShutdown signal received...")
+        while True:
+            try:
+                url_queue.get_nowait()
+                url_queue.task_done()
+            except Empty:
+                break
+    finally:
+        print("\nCleaning up... Waiting for active workers and DB writes to finish.")
+        for _ in worker_threads: url_queue.put(None)
+        for thread in worker_threads: thread.join()
+        result_queue.put(None)
+        results_thread.join()
+
+        # The writer commits everything queued ahead of the sentinel before it exits
+        db_write_queue.put(None)
+        writer_thread.join()
         
-        try:
-            while futures:
-                # Wait for the next future to complete
-                for future in as_completed(futures):
-                    original_url = futures.pop(future)
-                    result = future.result()
-                    
-                    if result["status"] == "success":
-                        db_write_queue.put(("add_content", (original_url, result['title'])))
-                        if result["new_links"]:
-                            # The DB Writer handles duplicates with INSERT OR IGNORE
-                            db_write_queue.put(("add_new_links", [(link,) for link in result["new_links"]]))
-                    else:
-                        db_write_queue.put(("update_status", (original_url, result['status'])))
-                    
-                    # --- FIXED: Immediately dispatch a new task to replace the one that just finished ---
-                    if urls_to_process:
-                        next_url = urls_to_process.popleft()
-                        futures[executor.submit(worker, next_url, driver_pool)] = next_url
-                    else:
-                        logging.info("URL queue is empty. Waiting for active workers to finish.")
-                        # The loop will naturally exit when the `futures` dict becomes empty
-
-        except KeyboardInterrupt:
-            print("\nShutdown signal received...")
-        finally:
-            print("\nCleaning up... Waiting for DB writes to finish.")
-            stop_event.set()
-            # Wait for the writer thread to process everything in the queue before exiting
-            db_write_queue.join() 
-            writer_thread.join()
-            
-            pbar.close()
-            # Cancel any remaining in-flight tasks
-            for future in futures: future.cancel()
-            while not driver_pool.empty():
-                try:
-                    driver, _ = driver_pool.get_nowait()
-                    if driver: driver.quit()
-                except Exception: pass
-            print("Crawler finished gracefully.")
+        pbar.close()
+        parse_pool.shutdown(cancel_futures=True)
+        http_client.close()
+        while not driver_pool.empty():
+            try:
+                driver, _ = driver_pool.get_nowait()
+                if driver: driver.quit()
+            except Exception: pass
+        print("Crawler finished gracefully.")
 
 if __name__ == "__main__":
     main()
@@ -2,12 +2,20 @@
 import sqlite3
 import pandas as pd
 import google.generativeai as genai
-import json
+import orjson
 import os
-import time
+import hashlib
+import random
+import asyncio
+import re
+from functools import lru_cache
+from aiolimiter import AsyncLimiter
+from google.api_core.exceptions import ResourceExhausted
 from tqdm import tqdm
 from colorama import Fore, Style, init
 
+from db import open_db
+
 init(autoreset=True)
 
 # --- Configuration (Gemini Version) ---
@@ -16,6 +24,14 @@ OUTPUT_TRAINING_FILE = "ue5_qa_training_dataset.jsonl"
 # Get your API key from Google AI Studio (https://aistudio.google.com/app/apikey)
 GEMINI_API_KEY = "YOUR_API_KEY"  # IMPORTANT: REPLACE WITH YOUR GOOGLE GEMINI API KEY
 GEMINI_MODEL = "gemini-1.5-flash-latest" # Fast, capable, and cost-effective
+CHUNK_SIZE = 8000 # Gemini 1.5 Flash has a large context window, we can use bigger chunks
+# Documents are split into blocks where a rolling hash of the last few words is a multiple of this
+# (about 64 words per block). Because boundaries depend on content, not position, shared boilerplate
+# hashes the same on every page. Words rather than lines, since content_raw is joined with spaces.
+BLOCK_BOUNDARY_MODULUS = 64 # Keep a power of two, so the boundary test only reads the low bits
+GEMINI_RPM = 60 # Requests per minute allowed by your Gemini quota. Raise this on a paid tier.
+MAX_RETRIES = 8 # Attempts per chunk on 429 Resource Exhausted; the backoff (1, 2, 4 ... 60 s) spans about two quota minutes
+GENERATION_WORKERS = 8 # Documents in flight at once; the limiter, not this, sets the request rate
 
 # This prompt instructs Gemini how to create the Q&A pairs.
 # Gemini responds well to clear, structured instructions and examples.
@@ -43,6 +59,173 @@ EXAMPLE JSON OUTPUT:
 }
 """
 
+# --- Database ---
+def init_db(conn: sqlite3.Connection):
+    """Creates the tables that record which content blocks and documents have already been sent to Gemini."""
+    conn.execute("CREATE TABLE IF NOT EXISTS seen_hashes (hash BLOB PRIMARY KEY) WITHOUT ROWID")
+    conn.execute("CREATE TABLE IF NOT EXISTS processed_urls (url TEXT PRIMARY KEY) WITHOUT ROWID")
+    conn.commit()
+
+def backfill_processed_urls(conn: sqlite3.Connection):
+    """Seeds processed_urls from an output file written before the table existed. Runs once."""
+    if not os.path.exists(OUTPUT_TRAINING_FILE) or conn.execute("SELECT 1 FROM processed_urls LIMIT 1").fetchone():
+        return
+    print(f"Importing already processed URLs from '{OUTPUT_TRAINING_FILE}'...")
+    urls = set()
+    with open(OUTPUT_TRAINING_FILE, 'rb') as f:
+        for line in f:
+            try:
+                urls.add(orjson.loads(line)['metadata']['source_url'])
+            except (orjson.JSONDecodeError, KeyError): continue
+    conn.executemany("INSERT OR IGNORE INTO processed_urls (url) VALUES (?)", ((url,) for url in urls))
+    conn.commit()
+
+def mark_processed(conn: sqlite3.Connection, url: str):
+    """Records a document whose chunks were all processed, so the next run skips it."""
+    conn.execute("INSERT OR IGNORE INTO processed_urls (url) VALUES (?)", (url,))
+    conn.commit()
+
+# --- Deduplication ---
+_WORD_RE = re.compile(r"(\S+)\s*")
+
+@lru_cache(maxsize=65536)
+def _word_hash(word: str) -> int:
+    # blake2b rather than hash(), which is salted per process and would move the boundaries between runs
+    return int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+
+def split_into_blocks(text: str):
+    """Yields content-defined blocks of text, so an edit only changes the block it falls in."""
+    # Gear hash: the low bits of h depend only on the last few words, so two pages that share a run
+    # of text cut it at the same words no matter what came before it
+    h = 0
+    start = 0
+    for match in _WORD_RE.finditer(text):
+        h = ((h << 1) + _word_hash(match.group(1))) & 0xFFFFFFFFFFFFFFFF
+        if h % BLOCK_BOUNDARY_MODULUS == 0:
+            yield text[start:match.end()]
+            start = match.end()
+    if start < len(text):
+        yield text[start:]
+
+def novel_chunks(conn: sqlite3.Connection, text: str, claimed: set) -> list:
+    """Returns (chunk, block_hashes) pairs built only from blocks not sent to Gemini before.
+
+    `claimed` holds the blocks already handed to a request in this run, so concurrent documents never send the same one.
+    """
+    chunks = []
+    current, current_hashes = [], []
+    current_len = 0
+    for block in split_into_blocks(text):
+        if not block.strip():
+            continue
+        digest = hashlib.blake2b(block.encode("utf-8"), digest_size=16).digest()
+        if digest in claimed or conn.execute("SELECT 1 FROM seen_hashes WHERE hash = ?", (digest,)).fetchone():
+            continue
+        claimed.add(digest)
+
+        if current and current_len + len(block) > CHUNK_SIZE:
+            chunks.append(("".join(current), current_hashes))
+            current, current_hashes, current_len = [], [], 0
+        current.append(block)
+        current_hashes.append(digest)
+        current_len += len(block)
+    if current:
+        chunks.append(("".join(current), current_hashes))
+
+    # A single block can still be longer than CHUNK_SIZE; cut it like the rest of the text used to be
+    result = []
+    for chunk, hashes in chunks:
+        pieces = [chunk[i:i + CHUNK_SIZE] for i in range(0, len(chunk), CHUNK_SIZE)]
+        # The hashes are recorded with the last piece, so a failure part-way through retries the whole block
+        result.extend((piece, hashes if i == len(pieces) - 1 else []) for i, piece in enumerate(pieces))
+    return result
+
+def mark_seen(conn: sqlite3.Connection, block_hashes: list):
+    """Records blocks whose Q&A pairs have been written, so later documents skip them."""
+    if block_hashes:
+        conn.executemany("INSERT OR IGNORE INTO seen_hashes (hash) VALUES (?)", ((h,) for h in block_hashes))
+        conn.commit()
+
+# --- Generation ---
+async def generate_qa_pairs(model, limiter: AsyncLimiter, chunk: str) -> list:
+    """Asks Gemini for Q&A pairs about one chunk, backing off only this request when the quota is hit."""
+    full_prompt = [SYSTEM_PROMPT, "Here is the documentation text:", chunk]
+    for attempt in range(MAX_RETRIES):
+        async with limiter:
+            try:
+                response = await model.generate_content_async(full_prompt)
+                break
+            except ResourceExhausted:
+                if attempt == MAX_RETRIES - 1:
+                    raise
+        delay = min(2 ** attempt, 60) + random.uniform(0, 1)
+        print(f"\n{Fore.YELLOW}Rate limit exceeded. Retrying this chunk in {delay:.1f} seconds...")
+        await asyncio.sleep(delay)
+
+    # --- Extract and validate the JSON content from Gemini's response ---
+    response_json = orjson.loads(response.text)
+    return response_json.get("qa_pairs", [])
+
+async def process_document(model, limiter, conn, claimed, url, text, out_file, pbar):
+    """Generates and writes the Q&A pairs for one document's novel chunks."""
+    # Only blocks that no earlier document contained are sent, so shared boilerplate costs one call
+    chunks = novel_chunks(conn, text, claimed)
+
+    for chunk, block_hashes in chunks:
+        if not chunk.strip(): continue
+
+        try:
+            qa_pairs = await generate_qa_pairs(model, limiter, chunk)
+
+            # Everything below runs on the event loop thread, so writes from concurrent documents never interleave
+            lines = [
+                orjson.dumps({
+                    "instruction": pair["question"],
+                    "input": "",
+                    "output": pair["answer"],
+                    "metadata": {"source_url": url}
+                })
+                for pair in qa_pairs if isinstance(pair, dict) and "question" in pair and "answer" in pair
+            ]
+            if lines:
+                # One write per chunk instead of one per pair
+                out_file.write(b"\n".join(lines) + b"\n")
+                out_file.flush()
+            mark_seen(conn, block_hashes)
+        except Exception as e:
+            print(f"\n{Fore.RED}An error occurred while processing URL {url}: {e}")
+            with open("qa_generation_errors.log", 'a', encoding='utf-8') as error_log:
+                error_log.write(f"URL: {url}\nError: {e}\n\n")
+            # Left out of processed_urls, so the next run retries the chunks that failed
+            pbar.update(1)
+            return
+
+    mark_processed(conn, url)
+    pbar.update(1)
+
+async def generate_dataset(model, df, conn, out_file, pbar):
+    """Processes the documents with GENERATION_WORKERS concurrent workers, keeping the request rate at GEMINI_RPM."""
+    limiter = AsyncLimiter(GEMINI_RPM, 60)
+    claimed = set()
+    # Bounded, so documents are only chunked once a worker is ready to send them
+    queue = asyncio.Queue(maxsize=GENERATION_WORKERS)
+
+    async def produce():
+        for row in df.itertuples(index=False):
+            await queue.put((row.url, row.content_raw))
+        for _ in range(GENERATION_WORKERS):
+            await queue.put(None)
+
+    async def consume():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            url, text = item
+            await process_document(model, limiter, conn, claimed, url, text, out_file, pbar)
+
+    await asyncio.gather(produce(), *(consume() for _ in range(GENERATION_WORKERS)))
+
 # --- Main Script ---
 def main():
     if GEMINI_API_KEY == "...":
@@ -64,70 +247,25 @@ def main():
     model = genai.GenerativeModel(GEMINI_MODEL, generation_config=generation_config)
 
     print(f"Loading content from '{DB_FILE}'...")
-    with sqlite3.connect(DB_FILE) as conn:
-        df = pd.read_sql_query("SELECT url, content_raw FROM analyzed_content", conn)
-    
+    conn = open_db(DB_FILE)
+    init_db(conn)
+    backfill_processed_urls(conn)
+
+    processed_count = conn.execute("SELECT COUNT(*) FROM processed_urls").fetchone()[0]
+    if processed_count:
+        print(f"Resuming. Found {processed_count} URLs already processed.")
+
+    # Processed documents are filtered out by the primary key lookup, not by replaying the output file
+    df = pd.read_sql_query(
+        "SELECT url, content_raw FROM analyzed_content WHERE url NOT IN (SELECT url FROM processed_urls)", conn
+    )
     print(f"Found {len(df)} documents to process.")
-    
-    processed_urls = set()
-    if os.path.exists(OUTPUT_TRAINING_FILE):
-        with open(OUTPUT_TRAINING_FILE, 'r', encoding='utf-8') as f:
-            for line in f:
-                try:
-                    processed_urls.add(json.loads(line)['metadata']['source_url'])
-                except (json.JSONDecodeError, KeyError): continue
-        print(f"Resuming. Found {len(processed_urls)} URLs already processed.")
-
-    with open(OUTPUT_TRAINING_FILE, 'a', encoding='utf-8') as f:
+
+    with open(OUTPUT_TRAINING_FILE, 'ab') as f:
         pbar = tqdm(total=len(df), desc="Generating Q&A Pairs")
-        
-        for index, row in df.iterrows():
-            if row['url'] in processed_urls:
-                pbar.update(1)
-                continue
-            
-            text = row['content_raw']
-            chunk_size = 8000 # Gemini 1.5 Flash has a large context window, we can use bigger chunks
-            chunks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
-
-            for chunk in chunks:
-                if not chunk.strip(): continue
-                
-                # Add a small delay to respect API rate limits
-                time.sleep(1.5) 
-                
-                try:
-                    # --- Call the Gemini API ---
-                    full_prompt = [SYSTEM_PROMPT, "Here is the documentation text:", chunk]
-                    response = model.generate_content(full_prompt)
-                    
-                    # --- Extract and validate the JSON content from Gemini's response ---
-                    response_json = json.loads(response.text)
-                    qa_pairs = response_json.get("qa_pairs", [])
-                    
-                    for pair in qa_pairs:
-                        if "question" in pair and "answer" in pair:
-                            formatted_entry = {
-                                "instruction": pair["question"],
-                                "input": "",
-                                "output": pair["answer"],
-                                "metadata": {"source_url": row['url']}
-                            }
-                            f.write(json.dumps(formatted_entry) + '\n')
-                            
-                except Exception as e:
-                    print(f"\n{Fore.RED}An error occurred while processing URL {row['url']}: {e}")
-                    if hasattr(e, 'response') and 'rate limit' in str(e.response.text).lower():
-                        print(f"{Fore.YELLOW}Rate limit likely exceeded. Waiting for 60 seconds...")
-                        time.sleep(60)
-
-                    with open("qa_generation_errors.log", 'a', encoding='utf-8') as error_log:
-                        error_log.write(f"URL: {row['url']}\nError: {e}\n\n")
-                    break
-            
-            pbar.update(1)
-            
+        asyncio.run(generate_dataset(model, df, conn, f, pbar))
     pbar.close()
+    conn.close()
     print(f"\n{Style.BRIGHT}Dataset generation complete!{Style.RESET_ALL}")
     print(f"Your training data is ready in '{OUTPUT_TRAINING_FILE}'.")
 
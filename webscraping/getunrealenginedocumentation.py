@@ -1,27 +1,31 @@
+import atexit
 import time
 import logging
 from logging.handlers import RotatingFileHandler
 import sqlite3
 import threading
 import multiprocessing
-import traceback
 import json
 import os
+import random
 from collections import deque
-from urllib.parse import urljoin, urlparse
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from queue import Queue
+from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from queue import Queue, Empty
 from contextlib import contextmanager
 
 import undetected_chromedriver as uc
 import spacy
-from bs4 import BeautifulSoup
+from selectolax.lexbor import LexborHTMLParser
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException, WebDriverException
 from tqdm import tqdm
 from colorama import Fore, Style, init
 
+from db import open_db
+
 # --- Initialization & Configuration ---
 init(autoreset=True)
 
@@ -35,14 +39,27 @@ LOG_FILE = "unified_scraper.log"
 
 START_URL = "https://dev.epicgames.com/documentation/en-us/unreal-engine"
 URL_PREFIX = "https://dev.epicgames.com/documentation/en-us/unreal-engine"
-ALLOWED_DOMAIN = "dev.epicgames.com"
 
 # Configuration
 MAX_WORKERS = 2 if DEBUG_MODE else min(8, (multiprocessing.cpu_count() or 1) + 4)
-DRIVER_RECYCLE_INTERVAL_SECONDS = 3600
+BROWSER_POOL_RECYCLE_AFTER = 100 # Pages between fresh tabs
+DRIVER_RECYCLE_AFTER_USES = 200 # Pages before a driver is replaced with a new Chrome process
+# Each driver retires after a random 50-100% of DRIVER_RECYCLE_AFTER_USES, so the pool's drivers never all retire together
+DRIVER_RECYCLE_JITTER = 0.5
 MAX_RETRIES = 3
 WEBDRIVER_TIMEOUT_SECONDS = 90
 NEW_LINK_BUFFER_SIZE = 200
+NER_BATCH_SIZE = 32
+WRITE_BATCH_SIZE = 500
+ENTITY_LABELS = ("PERSON", "ORG", "PRODUCT")
+# Only the entity recognizer is used; the other components would just burn CPU
+NER_DISABLED_PIPES = ["parser", "lemmatizer", "attribute_ruler"]
+# Only HTML is needed; images, fonts, media and trackers are blocked at the network layer
+BLOCKED_URL_PATTERNS = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.svg",
+    "*.woff", "*.woff2", "*.ttf", "*.mp4",
+    "*googletagmanager*", "*analytics*",
+]
 
 # --- AI Model Loading ---
 try:
@@ -62,14 +79,59 @@ logger.setLevel(logging.INFO if not DEBUG_MODE else logging.DEBUG)
 logger.addHandler(log_handler)
 
 # --- Database Schema & Initialization ---
+# Each thread lazily opens its own read connection; all writes go through the DBWriter thread.
+_tls = threading.local()
+
+def get_conn() -> sqlite3.Connection:
+    """Returns the calling thread's connection, opening it on first use."""
+    conn = getattr(_tls, "conn", None)
+    if conn is None:
+        conn = _tls.conn = open_db(DB_FILE, timeout=30, isolation_level=None)
+    return conn
+
+def close_conn():
+    """Closes the calling thread's connection, if it opened one."""
+    conn = getattr(_tls, "conn", None)
+    if conn is not None:
+        conn.close()
+        _tls.conn = None
+
+atexit.register(close_conn)
+
+# WITHOUT ROWID clusters rows on the url key, so each URL is stored once instead of in the table and its PK index
+URLS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS {} (
+        url TEXT PRIMARY KEY, status TEXT DEFAULT 'new',
+        attempts INTEGER DEFAULT 0, last_attempt_at REAL
+    ) WITHOUT ROWID"""
+
+def migrate_urls_table(conn: sqlite3.Connection):
+    """Rebuilds a urls table created before it was WITHOUT ROWID. Runs once; a no-op afterwards."""
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'urls'").fetchone()
+    if row is None or "WITHOUT ROWID" in row[0].upper():
+        return
+    print(f"{Style.DIM}Migrating the urls table to WITHOUT ROWID...")
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        cursor.execute(URLS_TABLE_SQL.format("urls_new"))
+        cursor.execute("INSERT INTO urls_new (url, status, attempts, last_attempt_at) SELECT url, status, attempts, last_attempt_at FROM urls")
+        # Dropping the old table also drops idx_urls_pending; init_db() creates it again on the new one
+        cursor.execute("DROP TABLE urls")
+        cursor.execute("ALTER TABLE urls_new RENAME TO urls")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
 def init_db(db_path: str):
-    with sqlite3.connect(db_path) as conn:
+    with open_db(db_path) as conn:
+        migrate_urls_table(conn)
         cursor = conn.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS urls (
-                url TEXT PRIMARY KEY, status TEXT DEFAULT 'new',
-                attempts INTEGER DEFAULT 0, last_attempt_at REAL
-            )""")
+        cursor.execute(URLS_TABLE_SQL.format("urls"))
+        # Partial covering index for the scheduler's pending-URL query: it only holds rows that are not
+        # done yet, and `status != 'success'` matches its WHERE clause, so the query never scans the table
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_urls_pending ON urls(attempts, status, url) WHERE status != 'success'")
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS analyzed_content (
                 url TEXT PRIMARY KEY, title TEXT, content_raw TEXT,
@@ -82,6 +144,10 @@ def create_driver():
     options = uc.ChromeOptions()
     options.headless = not DEBUG_MODE
     options.add_argument("--disable-blink-features=AutomationControlled")
+    # Return from driver.get() at DOMContentLoaded; the worker waits for the content it needs itself
+    options.page_load_strategy = "eager"
+    options.add_argument("--blink-settings=imagesEnabled=false")
+    options.add_experimental_option("prefs", {"profile.managed_default_content_settings.images": 2})
     if not DEBUG_MODE:
         options.add_argument('--no-sandbox')
         options.add_argument('--disable-dev-shm-usage')
@@ -92,125 +158,306 @@ def create_driver():
         chrome_major_version = 137
         driver = uc.Chrome(version_main=chrome_major_version, options=options)
     except Exception as e:
-        logging.error(f"Failed to create undetected_chromedriver: {e}")
+        logging.error("Failed to create undetected_chromedriver: %s", e)
         return None
+    block_heavy_resources(driver)
     return driver
 
+def block_heavy_resources(driver):
+    """Applies BLOCKED_URL_PATTERNS to the driver's current tab."""
+    try:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_URL_PATTERNS})
+    except Exception as e:
+        logging.warning("Could not enable request blocking, pages will load in full: %s", e)
+
+def refresh_driver(driver) -> bool:
+    """Moves the driver onto a fresh tab and closes the old ones, releasing their renderer memory.
+
+    This is the lightweight equivalent of handing out a new browser context: milliseconds, no new Chrome process.
+    """
+    try:
+        old_handles = driver.window_handles
+        driver.switch_to.new_window("tab")
+        fresh_handle = driver.current_window_handle
+        for handle in old_handles:
+            driver.switch_to.window(handle)
+            driver.close()
+        driver.switch_to.window(fresh_handle)
+        driver.execute_cdp_cmd("Network.clearBrowserCache", {})
+    except WebDriverException as e:
+        logging.warning("Could not refresh driver tab: %s", e)
+        return False
+    # Request blocking is per tab, so it has to be applied again
+    block_heavy_resources(driver)
+    return True
+
+def driver_retirement_threshold() -> int:
+    """Returns how many pages a new driver serves before it is replaced."""
+    return random.randint(int(DRIVER_RECYCLE_AFTER_USES * (1 - DRIVER_RECYCLE_JITTER)), DRIVER_RECYCLE_AFTER_USES)
+
+def quit_driver(driver):
+    try:
+        driver.quit()
+    except Exception as e:
+        logging.warning("Failed to quit a retired driver: %s", e)
+
 @contextmanager
-def get_driver_from_pool(driver_pool: Queue):
-    driver, creation_time = driver_pool.get()
+def get_driver_from_pool(driver_pool: Queue, replacer: ThreadPoolExecutor):
+    # Pool entries are (driver, uses, retire_at, replacement), where replacement is the Future of the Chrome
+    # being launched to take over from this driver, or None
+    driver, uses, retire_at, replacement = driver_pool.get()
     try:
-        if time.time() - creation_time > DRIVER_RECYCLE_INTERVAL_SECONDS:
-            if driver: driver.quit()
-            driver = create_driver()
-            creation_time = time.time()
+        if uses and uses % BROWSER_POOL_RECYCLE_AFTER == 0:
+            # A fresh tab every N pages keeps long-lived renderers from accumulating leaked memory
+            refresh_driver(driver)
         yield driver
     finally:
-        driver_pool.put((driver, creation_time))
+        uses += 1
+        if replacement is None and uses >= retire_at:
+            # The replacement cold-starts on a replacer thread while this driver keeps serving pages
+            replacement = replacer.submit(create_driver)
+        if replacement is not None and replacement.done():
+            new_driver = replacement.result()
+            replacement = None
+            if new_driver:
+                # Only swap once the new Chrome is up, so the pool never shrinks while it starts
+                replacer.submit(quit_driver, driver)
+                driver, uses, retire_at = new_driver, 0, driver_retirement_threshold()
+            else:
+                retire_at = uses + driver_retirement_threshold()
+        driver_pool.put((driver, uses, retire_at, replacement))
 
-def worker(url: str, driver_pool: Queue, nlp_model) -> dict:
+def extract_links(tree: LexborHTMLParser, base_url: str, _urljoin=urljoin, _prefix=URL_PREFIX) -> set:
+    """Returns the documentation links found in the page."""
+    # Resolve each href once; the URL_PREFIX check already covers the domain.
+    # The defaults bind urljoin/URL_PREFIX as fast locals for this per-anchor loop.
+    new_links = set()
+    for a in tree.css("a[href]"):
+        href = a.attributes.get("href")
+        if not href: continue
+        link = _urljoin(base_url, href)
+        if link.startswith(_prefix) and "#" not in link:
+            new_links.add(link)
+    return new_links
+
+def worker(url: str, driver_pool: Queue, replacer: ThreadPoolExecutor) -> dict:
     try:
-        with get_driver_from_pool(driver_pool) as driver:
-            if driver is None: return {"status": "failed_driver_error", "new_links": set()}
+        with get_driver_from_pool(driver_pool, replacer) as driver:
             driver.get(url)
-            WebDriverWait(driver, WEBDRIVER_TIMEOUT_SECONDS).until(EC.title_contains("Unreal Engine"))
-            time.sleep(3)
-            soup = BeautifulSoup(driver.page_source, "html.parser")
-            title = soup.title.string.strip() if soup.title else ""
-            body_div = soup.find("div", {"id": "main-content"})
+            # Returns as soon as the docs title and the content div are present, instead of sleeping a fixed 3 s
+            try:
+                WebDriverWait(driver, WEBDRIVER_TIMEOUT_SECONDS).until(EC.all_of(
+                    EC.title_contains("Unreal Engine"),
+                    EC.presence_of_element_located((By.ID, "main-content")),
+                ))
+            except TimeoutException:
+                logging.warning("Timeout waiting for content on %s. Attempting to scrape partial content.", url)
+            # selectolax's C parser builds the tree many times faster than BeautifulSoup on these large pages
+            tree = LexborHTMLParser(driver.page_source)
+            title_node = tree.css_first("title")
+            title = title_node.text(strip=True) if title_node else ""
+            body_div = tree.css_first("div#main-content")
             if not body_div: return {"status": "failed_no_content", "new_links": set()}
-            content_raw = body_div.get_text(separator=' ', strip=True)
-            new_links = {
-                urljoin(url, a["href"]) for a in soup.find_all("a", href=True)
-                if urljoin(url, a["href"]).startswith(URL_PREFIX) and urlparse(urljoin(url, a["href"])).netloc == ALLOWED_DOMAIN and "#" not in urljoin(url, a["href"])
-            }
-            doc = nlp_model(content_raw[:nlp_model.max_length])
-            entities = {"PERSON": list({e.text for e in doc.ents if e.label_ == "PERSON"}), "ORG": list({e.text for e in doc.ents if e.label_ == "ORG"}), "PRODUCT": list({e.text for e in doc.ents if e.label_ == "PRODUCT"})}
-            return {"status": "success", "title": title, "new_links": new_links, "content_raw": content_raw, "entities_json": json.dumps(entities), "scraped_at": time.time()}
+            content_raw = body_div.text(separator=' ', strip=True)
+            new_links = extract_links(tree, url)
+            return {"status": "success", "title": title, "new_links": new_links, "content_raw": content_raw, "scraped_at": time.time()}
     except Exception:
-        logging.error(f"An unexpected error occurred in worker for {url}:\n{traceback.format_exc()}")
+        logging.exception("An unexpected error occurred in worker for %s", url)
         return {"status": "failed_exception", "new_links": set()}
 
+# --- Dedicated NER Thread ---
+def extract_entities(doc) -> str:
+    """Returns the unique PERSON/ORG/PRODUCT entities of a spaCy doc as JSON."""
+    entities = {label: set() for label in ENTITY_LABELS}
+    for ent in doc.ents:
+        if ent.label_ in entities: entities[ent.label_].add(ent.text)
+    return json.dumps({label: list(texts) for label, texts in entities.items()})
+
+def ner_worker(nlp_model, ner_queue: Queue, db_write_queue: Queue):
+    """Runs spaCy over scraped pages in batches with nlp.pipe and hands the finished rows to the DB writer."""
+    stopping = False
+    while not stopping:
+        # Block for the first page, then take whatever else is already waiting, up to one batch
+        batch = []
+        while len(batch) < NER_BATCH_SIZE:
+            try:
+                item = ner_queue.get_nowait() if batch else ner_queue.get()
+            except Empty:
+                break
+            if item is None:
+                stopping = True
+                break
+            batch.append(item)
+        if not batch: continue
+
+        texts = [content_raw[:nlp_model.max_length] for _, _, content_raw, _ in batch]
+        try:
+            docs = nlp_model.pipe(texts, batch_size=NER_BATCH_SIZE, disable=NER_DISABLED_PIPES)
+            for (url, title, content_raw, scraped_at), doc in zip(batch, docs):
+                db_write_queue.put(("add_content", (url, title, content_raw, extract_entities(doc), scraped_at)))
+        except Exception:
+            logging.exception("[NERWorker] Failed to analyze a batch of %d pages", len(batch))
+            for url, _, _, _ in batch:
+                db_write_queue.put(("update_status", ("failed_exception", time.time(), url)))
+    logging.info("NERWorker thread finished.")
+
 # --- IMPROVEMENT: Dedicated Database Writer Thread ---
-def db_writer(db_path: str, write_queue: Queue, stop_event: threading.Event):
-    """A dedicated thread to handle all database writes, preventing lock contention."""
-    conn = sqlite3.connect(db_path, timeout=10)
+def apply_write_jobs(cursor: sqlite3.Cursor, items: list):
+    """Executes queued writes inside the writer's open transaction."""
+    status_updates, content_rows, link_rows = [], [], []
+    for job_type, data in items:
+        if job_type == "update_status":
+            status_updates.append(data)
+        elif job_type == "add_content":
+            content_rows.append(data)
+        elif job_type == "add_new_links":
+            link_rows.extend(data)
+
+    cursor.executemany("INSERT OR IGNORE INTO urls (url) VALUES (?)", link_rows)
+    cursor.executemany("UPDATE urls SET status = ?, attempts = attempts + 1, last_attempt_at = ? WHERE url = ?", status_updates)
+    cursor.executemany("INSERT OR REPLACE INTO analyzed_content (url, title, content_raw, entities_json, scraped_at) VALUES (?, ?, ?, ?, ?)", content_rows)
+    cursor.executemany("UPDATE urls SET status = 'success' WHERE url = ?", [(row[0],) for row in content_rows])
+
+def job_url(item: tuple):
+    """Returns the page URL a status or content job is for, or None for other jobs."""
+    job_type, data = item
+    if job_type == "update_status": return data[2]
+    if job_type == "add_content": return data[0]
+    return None
+
+def db_writer(db_path: str, write_queue: Queue, content_pending: set):
+    """A dedicated thread to handle all database writes, preventing lock contention. Stops on a None job."""
+    conn = open_db(db_path, timeout=10)
     cursor = conn.cursor()
     
-    while not stop_event.is_set() or not write_queue.empty():
+    stopping = False
+    while not stopping:
+        # Sleep until there is work, then take everything else already waiting so it shares one transaction (one fsync)
+        items = []
+        while len(items) < WRITE_BATCH_SIZE:
+            try:
+                item = write_queue.get_nowait() if items else write_queue.get()
+            except Empty:
+                break
+            if item is None:
+                write_queue.task_done()
+                stopping = True
+                break
+            items.append(item)
+        if not items: continue
+
         try:
-            item = write_queue.get(timeout=1)
-            if item is None: continue
-
-            job_type, data = item
-            if job_type == "update_status":
-                cursor.execute("UPDATE urls SET status = ?, attempts = attempts + 1, last_attempt_at = ? WHERE url = ?", data)
-            elif job_type == "add_content":
-                cursor.execute("INSERT OR REPLACE INTO analyzed_content (url, title, content_raw, entities_json, scraped_at) VALUES (?, ?, ?, ?, ?)", data)
-                cursor.execute("UPDATE urls SET status = 'success' WHERE url = ?", (data[0],))
-            elif job_type == "add_new_links":
-                cursor.executemany("INSERT OR IGNORE INTO urls (url) VALUES (?)", data)
-            
+            cursor.execute("BEGIN IMMEDIATE")
+            apply_write_jobs(cursor, items)
             conn.commit()
-            write_queue.task_done()
-        except Queue.empty:
-            continue
         except Exception as e:
-            logging.error(f"[DBWriter] Error processing job: {e}")
+            conn.rollback()
+            # One bad job must not take the rest of the batch (already analyzed pages) down with it
+            logging.error("[DBWriter] A batch of %d jobs failed, retrying them one at a time: %s", len(items), e)
+            for item in items:
+                try:
+                    cursor.execute("BEGIN IMMEDIATE")
+                    apply_write_jobs(cursor, [item])
+                    conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    logging.error("[DBWriter] Dropped a %s job for %s: %s", item[0], job_url(item), e)
+                    if item[0] == "add_content":
+                        # Count it as a failed attempt, so MAX_RETRIES still bounds how often the page is re-scraped
+                        try:
+                            cursor.execute("UPDATE urls SET status = 'failed_exception', attempts = attempts + 1, last_attempt_at = ? WHERE url = ?", (time.time(), job_url(item)))
+                            conn.commit()
+                        except Exception:
+                            conn.rollback()
+        finally:
+            # Committed or dropped, these URLs no longer wait on the writer; any that did not reach
+            # 'success' are handed out again by the scheduler
+            for item in items: content_pending.discard(job_url(item))
+            for _ in items: write_queue.task_done()
     conn.close()
+    logging.info("DBWriter thread finished.")
 
 # --- Main Orchestrator ---
 def main():
     init_db(DB_FILE)
     
     db_write_queue = Queue()
-    stop_event = threading.Event()
+    # Scraped URLs whose rows have not been committed yet, so the scheduler does not hand them out again
+    content_pending = set()
     
     # Start the dedicated DB writer thread
-    writer_thread = threading.Thread(target=db_writer, args=(DB_FILE, db_write_queue, stop_event), daemon=True, name="DBWriter")
+    writer_thread = threading.Thread(target=db_writer, args=(DB_FILE, db_write_queue, content_pending), daemon=True, name="DBWriter")
     writer_thread.start()
 
-    with sqlite3.connect(DB_FILE) as conn:
-        cursor = conn.cursor()
-        cursor.execute("INSERT OR IGNORE INTO urls (url) VALUES (?)", (START_URL,))
-        conn.commit()
+    # spaCy runs in its own thread so the scraper threads only ever wait on the browser
+    ner_queue = Queue()
+    ner_thread = threading.Thread(target=ner_worker, args=(nlp, ner_queue, db_write_queue), daemon=True, name="NERWorker")
+    ner_thread.start()
+
+    get_conn().execute("INSERT OR IGNORE INTO urls (url) VALUES (?)", (START_URL,))
 
     driver_pool = Queue(maxsize=MAX_WORKERS)
-    for _ in range(MAX_WORKERS):
-        driver = create_driver()
-        if driver: driver_pool.put((driver, time.time()))
+    # Launch all browsers at once; each cold start is several seconds of mostly waiting
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="DriverLauncher") as launcher:
+        for driver in launcher.map(lambda _: create_driver(), range(MAX_WORKERS)):
+            if driver: driver_pool.put((driver, 0, driver_retirement_threshold(), None))
 
     if driver_pool.empty():
         print(f"{Fore.RED}Could not create any WebDriver instances. Exiting.")
-        stop_event.set()
+        ner_queue.put(None)
+        ner_thread.join()
+        db_write_queue.put(None)
         writer_thread.join()
         return
 
+    # Replacements for retiring drivers start here in parallel, off the scraper threads
+    driver_replacer = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="DriverReplacer")
+
     with ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="Scraper") as executor:
         futures = {}
+        # URLs currently submitted to the executor, kept alongside `futures` for O(1) membership checks
+        in_flight = set()
         new_links_buffer = set()
         
         try:
             while True:
-                with sqlite3.connect(DB_FILE) as conn:
-                    cursor = conn.cursor()
-                    cursor.execute("SELECT url FROM urls WHERE status != 'success' AND attempts < ?", (MAX_RETRIES,))
-                    urls_to_process = [row[0] for row in cursor.fetchall() if row[0] not in {f.result().get('url', '') for f in futures if f.done() and f.result()}][:MAX_WORKERS*2-len(futures)]
-
-                if urls_to_process:
+                free_slots = MAX_WORKERS * 2 - len(futures)
+                if free_slots:
+                    # Over-fetch by the number of URLs that will be skipped so the free slots can still be filled
+                    cursor = get_conn().execute(
+                        "SELECT url FROM urls WHERE status != 'success' AND attempts < ? LIMIT ?",
+                        (MAX_RETRIES, free_slots + len(in_flight) + len(content_pending)),
+                    )
+                    urls_to_process = [url for (url,) in cursor if url not in in_flight and url not in content_pending][:free_slots]
                     for url in urls_to_process:
-                        if url not in [futures[f] for f in futures]:
-                            futures[executor.submit(worker, url, driver_pool, nlp)] = url
-                elif not futures:
+                        in_flight.add(url)
+                        futures[executor.submit(worker, url, driver_pool, driver_replacer)] = url
+
+                if not futures:
+                    if new_links_buffer:
+                        # The last links found are below the flush threshold; commit them and look again
+                        db_write_queue.put(("add_new_links", [(link,) for link in new_links_buffer]))
+                        new_links_buffer.clear()
+                        db_write_queue.join()
+                        continue
+                    if content_pending:
+                        # Pages still in NER or the writer may fail and need another attempt
+                        time.sleep(1)
+                        continue
                     print(f"{Fore.GREEN}All tasks complete. Waiting for DB writer to finish...")
                     break
 
-                for future in as_completed(futures):
+                # Refill as soon as any page finishes, instead of idling until the slowest one in the batch is done
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
                     original_url = futures.pop(future)
+                    in_flight.discard(original_url)
                     result = future.result()
 
+                    content_pending.add(original_url)
                     if result["status"] == "success":
-                        db_write_queue.put(("add_content", (original_url, result['title'], result['content_raw'], result['entities_json'], result['scraped_at'])))
+                        ner_queue.put((original_url, result['title'], result['content_raw'], result['scraped_at']))
                     else:
                         db_write_queue.put(("update_status", (result['status'], time.time(), original_url)))
                     
@@ -219,8 +466,6 @@ def main():
                     if len(new_links_buffer) >= NEW_LINK_BUFFER_SIZE:
                         db_write_queue.put(("add_new_links", [(link,) for link in new_links_buffer]))
                         new_links_buffer.clear()
-                
-                if not futures: time.sleep(2)
 
         except KeyboardInterrupt:
             print("\nShutdown signal received...")
@@ -229,16 +474,24 @@ def main():
             if new_links_buffer:
                 db_write_queue.put(("add_new_links", [(link,) for link in new_links_buffer]))
             
-            stop_event.set()
-            db_write_queue.join()
+            # Let the NER thread finish the pages it already has before the writer shuts down
+            ner_queue.put(None)
+            ner_thread.join()
+            # The writer commits everything queued ahead of the sentinel before it exits
+            db_write_queue.put(None)
             writer_thread.join()
 
             for future in futures: future.cancel()
-            while not driver_pool.empty():
-                try:
-                    driver, _ = driver_pool.get_nowait()
-                    if driver: driver.quit()
-                except Exception: pass
+
+    # Only now, with every scraper thread done and its driver back in the pool: let the replacer finish the
+    # launches it is building, so those drivers are quit below too
+    driver_replacer.shutdown(wait=True)
+    while not driver_pool.empty():
+        try:
+            driver, _, _, replacement = driver_pool.get_nowait()
+            driver.quit()
+            if replacement and replacement.result(): replacement.result().quit()
+        except Exception: pass
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
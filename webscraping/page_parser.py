@@ -0,0 +1,47 @@
+# page_parser.py
+"""HTML parsing for crawler.py's process pool.
+
+The pool's children import this module instead of crawler.py, so it must stay free of side effects:
+no logging handlers, HTTP clients, browser imports or atexit hooks.
+"""
+from urllib.parse import urljoin, urlsplit
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+# Only the <title> and the anchors are needed, so lxml skips building every other node.
+_STRAINER = SoupStrainer(["title", "a"])
+
+def extract_links(soup: BeautifulSoup, base_url: str, url_prefix: str, _urljoin=urljoin) -> set:
+    """Returns the normalized links under `url_prefix` found in the page."""
+    # Resolve each href once; the prefix check already implies the allowed domain.
+    # The default binds urljoin as a fast local for this per-anchor loop.
+    parts = urlsplit(url_prefix)
+    origin = f"{parts.scheme}://{parts.netloc}"
+    new_links = set()
+    add = new_links.add
+    for a in soup.find_all("a", href=True):
+        href = a["href"]
+        # Most hrefs are absolute or root-relative, which needs no urljoin parse at all
+        if href.startswith(url_prefix):
+            full = href
+        elif href.startswith("//"):
+            full = _urljoin(base_url, href)
+        elif href.startswith("/"):
+            full = origin + href
+        elif href.startswith("http"):
+            continue  # absolute link to another site
+        else:
+            full = _urljoin(base_url, href)
+        if not full.startswith(url_prefix): continue
+        pos = full.find("#")
+        if pos != -1: full = full[:pos]
+        pos = full.find("?")
+        if pos != -1: full = full[:pos]
+        add(full)
+    return new_links
+
+def parse_page(html: str, base_url: str, url_prefix: str) -> tuple:
+    """Returns (title, links) for a page. Runs in the parse process pool, outside the GIL."""
+    soup = BeautifulSoup(html, "lxml", parse_only=_STRAINER)
+    title = soup.title.string.strip() if soup.title and soup.title.string else ""
+    return title, extract_links(soup, base_url, url_prefix)
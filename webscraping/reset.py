@@ -1,10 +1,10 @@
 # cleanup_db.py
 import sqlite3
-from urllib.parse import urlparse
-from collections import defaultdict
-from tqdm import tqdm
+import pandas as pd
 import os
 
+from db import open_db
+
 DB_FILE = "crawled_data.db"
 
 def main():
@@ -18,47 +18,39 @@ def main():
 
     print(f"Connecting to database '{DB_FILE}' to begin cleanup...")
     
-    url_map = defaultdict(list)
-    scraped_data = {}
     conn = None
 
     try:
-        conn = sqlite3.connect(DB_FILE)
+        conn = open_db(DB_FILE)
         cursor = conn.cursor()
 
         print("Step 1: Reading all URLs from the database...")
-        cursor.execute("SELECT url, title, scraped_at, attempts, status FROM pages")
-        all_rows = cursor.fetchall()
-        
-        if not all_rows:
+        df = pd.read_sql_query("SELECT url, title, scraped_at, attempts, status FROM pages", conn)
+
+        if df.empty:
             print("Database is empty. No cleanup needed.")
             return
 
-        print(f"Step 2: Analyzing {len(all_rows)} URLs for duplicates...")
-        for row in tqdm(all_rows, desc="Analyzing URLs"):
-            original_url, title, scraped_at, attempts, status = row
-            normalized_url = urlparse(original_url)._replace(query="", fragment="").geturl()
-            
-            url_map[normalized_url].append(original_url)
-            
-            if status == 'success' and title is not None:
-                if normalized_url not in scraped_data:
-                    scraped_data[normalized_url] = (title, scraped_at, attempts, status)
+        print(f"Step 2: Analyzing {len(df)} URLs for duplicates...")
+        # Same result as urlparse()._replace(query="", fragment="").geturl(), but done column-wide in C
+        df["url"] = df["url"].str.split("#", n=1).str[0].str.split("?", n=1).str[0]
 
-        print(f"\nAnalysis complete. Found {len(url_map)} unique pages.")
+        # One row per normalized URL, in first-seen order, keeping the first successful scrape if there is one
+        unique_urls = pd.DataFrame({"url": df["url"].unique()})
+        scraped = df[df["status"].eq("success") & df["title"].notna()].drop_duplicates("url")
+        clean = unique_urls.merge(scraped, on="url", how="left")
+        clean["attempts"] = clean["attempts"].fillna(0).astype(int)
+        clean["status"] = clean["status"].fillna("new")
+
+        print(f"\nAnalysis complete. Found {len(clean)} unique pages.")
         
         print("Step 3: Cleaning the database. This may take a moment...")
         
         cursor.execute("DELETE FROM pages")
 
-        rows_to_insert = []
-        for normalized_url in url_map.keys():
-            if normalized_url in scraped_data:
-                title, scraped_at, attempts, status = scraped_data[normalized_url]
-                rows_to_insert.append((normalized_url, title, scraped_at, attempts, status))
-            else:
-                rows_to_insert.append((normalized_url, None, None, 0, 'new'))
-
+        # object dtype turns NaN into None and numpy scalars into plain Python values sqlite3 can bind
+        clean = clean.astype(object).where(clean.notna(), None)
+        rows_to_insert = list(clean[["url", "title", "scraped_at", "attempts", "status"]].itertuples(index=False, name=None))
         cursor.executemany(
             "INSERT OR IGNORE INTO pages (url, title, scraped_at, attempts, status) VALUES (?, ?, ?, ?, ?)",
             rows_to_insert
@@ -1,41 +1,70 @@
 # train_model.py
 import torch
-import sqlite3
-import pandas as pd
 from transformers import (
     AutoTokenizer,
     AutoModelForCausalLM,
     TrainingArguments,
     Trainer,
-    BitsAndBytesConfig
+    BitsAndBytesConfig,
+    DataCollatorForLanguageModeling
 )
-from datasets import Dataset
+from peft import LoraConfig, get_peft_model, prepare_model_for_kbit_training
+from datasets import Dataset, Features, Value
 import os
+from itertools import chain
+
+from db import open_db
 
 # --- Configuration ---
 DB_FILE = "crawler_state.db"
 BASE_MODEL = "gpt2"  # A solid, small starting model. You can swap this for others like "EleutherAI/pythia-1b-deduped".
 NEW_MODEL_NAME = "unreal-engine-gpt2" # The name of the folder for your new model
 TRAINING_EPOCHS = 1 # 1-3 epochs is usually sufficient for domain adaptation.
-LEARNING_RATE = 2e-5
-BATCH_SIZE = 1 # Keep this at 1 for low VRAM. We use gradient accumulation to compensate.
-GRADIENT_ACCUMULATION_STEPS = 8 # Effective batch size will be BATCH_SIZE * GRADIENT_ACCUMULATION_STEPS (1*8=8)
+LEARNING_RATE = 2e-4 # LoRA adapters start at zero and need a ~10x higher rate than full fine-tuning
+BATCH_SIZE = 8 # The 4-bit model plus gradient checkpointing leaves room for a real batch. Lower this if you run out of VRAM.
+GRADIENT_ACCUMULATION_STEPS = 2 # Effective batch size will be BATCH_SIZE * GRADIENT_ACCUMULATION_STEPS (8*2=16)
+TOKENIZE_WORKERS = os.cpu_count() or 1 # Processes used to tokenize the dataset in parallel
+BLOCK_SIZE = 1024 # Tokens per training example. Documents are packed end-to-end into blocks of this size.
+LORA_RANK = 16 # Rank of the LoRA adapter matrices. Higher means more trainable parameters.
+LORA_DROPOUT = 0.05
+LORA_TARGET_MODULES = ["c_attn"] # GPT-2's fused query/key/value projection
 
 # --- Main Script ---
+def get_corpus_version(db_path: str) -> tuple:
+    """Returns (row count, latest scraped_at) of analyzed_content, which changes whenever pages are added or re-scraped."""
+    conn = open_db(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        return tuple(conn.execute("SELECT COUNT(*), MAX(scraped_at) FROM analyzed_content").fetchone())
+    finally:
+        conn.close()
+
+def iter_documents(db_path: str, corpus_version: tuple):
+    """Yields the scraped documents one row at a time, so the corpus is never held in memory.
+
+    `corpus_version` is not read here; it is part of the dataset fingerprint, so a changed corpus is not served from cache.
+    """
+    conn = open_db(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        for (content_raw,) in conn.execute("SELECT content_raw FROM analyzed_content"):
+            yield {"text": content_raw}
+    finally:
+        conn.close()
+
 def create_training_dataset(db_path: str) -> Dataset:
-    """Loads the scraped content from the SQLite database."""
+    """Streams the scraped content from the SQLite database into a disk-backed Dataset."""
     if not os.path.exists(db_path):
         raise FileNotFoundError(f"Database file not found at {db_path}. Please run the scraper first.")
-    
-    with sqlite3.connect(db_path) as conn:
-        # Load the raw content into a pandas DataFrame
-        df = pd.read_sql_query("SELECT content_raw FROM analyzed_content", conn)
-        # Rename column for clarity
-        df.rename(columns={"content_raw": "text"}, inplace=True)
 
-    print(f"Loaded {len(df)} documents from the database.")
-    # Convert the DataFrame to a Hugging Face Dataset object
-    return Dataset.from_pandas(df)
+    # Rows are written straight to an Arrow cache file that is memory-mapped, not copied into RAM.
+    # The cache is keyed on gen_kwargs, so the corpus version makes a newer scrape build a new one.
+    dataset = Dataset.from_generator(
+        iter_documents,
+        gen_kwargs={"db_path": db_path, "corpus_version": get_corpus_version(db_path)},
+        features=Features({"text": Value("string")}),
+    )
+
+    print(f"Loaded {len(dataset)} documents from the database.")
+    return dataset
 
 def main():
     print("--- Domain-Adaptive Pre-training Script ---")
@@ -51,11 +80,15 @@ def main():
     # --- 2. Load Tokenizer and Model ---
     print(f"\n[Step 2/5] Loading base model and tokenizer: '{BASE_MODEL}'...")
 
+    # bf16 has the range of fp32 and is the better choice on Ampere or newer; older GPUs fall back to fp16
+    use_bf16 = torch.cuda.is_available() and torch.cuda.is_bf16_supported()
+
     # Configure quantization to load the model in 4-bit, saving a lot of memory.
+    # The compute dtype follows the mixed-precision mode, since pre-Ampere GPUs have no bf16 kernels.
     quantization_config = BitsAndBytesConfig(
         load_in_4bit=True,
         bnb_4bit_quant_type="nf4",
-        bnb_4bit_compute_dtype=torch.bfloat16
+        bnb_4bit_compute_dtype=torch.bfloat16 if use_bf16 else torch.float16
     )
 
     # Load the tokenizer
@@ -68,7 +101,21 @@ def main():
         quantization_config=quantization_config,
         device_map="auto", # Automatically use the GPU if available
     )
-    
+    # Casts the non-quantized layers to fp32 and enables gradient checkpointing so the 4-bit model can be trained
+    model = prepare_model_for_kbit_training(model)
+
+    # The 4-bit weights stay frozen; only small LoRA adapters on the attention projection are trained.
+    lora_config = LoraConfig(
+        r=LORA_RANK,
+        lora_alpha=2 * LORA_RANK,
+        target_modules=LORA_TARGET_MODULES,
+        lora_dropout=LORA_DROPOUT,
+        bias="none",
+        task_type="CAUSAL_LM",
+    )
+    model = get_peft_model(model, lora_config)
+    model.print_trainable_parameters()
+
     print("Model and tokenizer loaded successfully.")
 
     # --- 3. Prepare and Tokenize the Dataset ---
@@ -76,9 +123,21 @@ def main():
     
     def tokenize_function(examples):
         # Tokenize the text. The tokenizer converts text into numbers (token IDs) the model understands.
-        return tokenizer(examples["text"], truncation=True, max_length=1024)
-
-    tokenized_dataset = dataset.map(tokenize_function, batched=True, remove_columns=["text"])
+        # No truncation here: long documents are split into blocks by group_texts instead of losing their tail.
+        return tokenizer(examples["text"])
+
+    def group_texts(examples):
+        # Concatenate every document in the batch and cut the result into BLOCK_SIZE chunks,
+        # so no example needs padding. The leftover tokens at the end of the batch are dropped.
+        concatenated = {k: list(chain.from_iterable(examples[k])) for k in examples.keys()}
+        total_length = (len(concatenated["input_ids"]) // BLOCK_SIZE) * BLOCK_SIZE
+        return {
+            k: [t[i:i + BLOCK_SIZE] for i in range(0, total_length, BLOCK_SIZE)]
+            for k, t in concatenated.items()
+        }
+
+    tokenized_dataset = dataset.map(tokenize_function, batched=True, num_proc=TOKENIZE_WORKERS, remove_columns=["text"])
+    tokenized_dataset = tokenized_dataset.map(group_texts, batched=True, num_proc=TOKENIZE_WORKERS)
     print("Dataset prepared.")
 
     # --- 4. Configure Training ---
@@ -91,7 +150,10 @@ def main():
         learning_rate=LEARNING_RATE,
         logging_steps=10,        # Log progress every 10 steps
         save_steps=100,          # Save a checkpoint every 100 steps
-        fp16=torch.cuda.is_available(), # Use mixed-precision if a GPU is available (faster)
+        bf16=use_bf16,
+        fp16=torch.cuda.is_available() and not use_bf16, # Use mixed-precision if a GPU is available (faster)
+        gradient_checkpointing=True, # Recompute activations in the backward pass instead of storing them
+        optim="paged_adamw_8bit", # bitsandbytes optimizer with 8-bit state that pages to CPU under memory pressure
         push_to_hub=False,       # Do not upload to Hugging Face Hub
     )
 
@@ -103,15 +165,17 @@ def main():
         model=model,
         args=training_args,
         train_dataset=tokenized_dataset,
+        # Builds the shifted labels for causal LM training and pads any short batch
+        data_collator=DataCollatorForLanguageModeling(tokenizer, mlm=False),
     )
 
     trainer.train()
 
     # --- Save the Final Model ---
-    print("\nTraining complete! Saving final model...")
+    print("\nTraining complete! Saving final LoRA adapter...")
     trainer.save_model(NEW_MODEL_NAME)
     tokenizer.save_pretrained(NEW_MODEL_NAME)
-    print(f"✅ Model saved to folder: './{NEW_MODEL_NAME}'")
+    print(f"✅ Adapter saved to folder: './{NEW_MODEL_NAME}' (load it on top of '{BASE_MODEL}' with peft's PeftModel.from_pretrained)")
 
 
 if __name__ == "__main__":